@@ -5,13 +5,20 @@ Monitors one or more GotSport schedule URLs for changes and sends notifications
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import hashlib
 import os
 import sys
 import re
 from datetime import datetime
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+import orjson
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # extract_match_texts falls back to the stdlib streaming parser
+    LexborHTMLParser = None
 
 
 # Each entry: (label, url, state_file)
@@ -30,15 +37,52 @@ SCHEDULES = [
 
 NTFY_TOPIC = os.environ.get("NTFY_TOPIC", "afc-schedule-updates")
 
-
-def fetch_schedule(url):
-    """Fetch the schedule page content"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    }
-    response = requests.get(url, headers=headers, timeout=30)
-    response.raise_for_status()
-    return response.text
+# Bumped whenever calculate_hash() changes output format; state without a version is
+# from the original json.dumps + SHA-256 hash
+HASH_VERSION = 2
+
+# Shared session so gotsport.com and ntfy.sh connections are kept alive across requests.
+# Accept-Encoding is left to requests, which adds "br" whenever brotli is importable
+# and so never advertises an encoding it can't decode.
+SESSION = requests.Session()
+SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+})
+SESSION.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+_DATE_RE = re.compile(r'([A-Z][a-z]{2}\s+\d{1,2},\s+\d{4})')
+_TIME_RE = re.compile(r'(\d{1,2}:\d{2}\s+[AP]M\s+[A-Z]{3})')
+_SCORE_RE = re.compile(r'(\d+\s*-\s*\d+)')
+_TEAM_RE = re.compile(r'([A-Z][^()]+?)\s*\([HA]\)')
+
+# Match containers: div/tr whose class contains a keyword, case-insensitively. Evaluated
+# inside lexbor; one compound selector keeps each element once, in document order.
+_MATCH_KEYWORDS = ('game', 'match', 'schedule-row')
+_MATCH_SELECTOR = ':is(div, tr):is({})'.format(
+    ', '.join(f'[class*={keyword} i]' for keyword in _MATCH_KEYWORDS)
+)
+
+
+def fetch_schedule(url, previous_state=None):
+    """Fetch the schedule page as (html_bytes, raw_hash, etag, last_modified), or None if not modified"""
+    headers = {}
+    if previous_state:
+        if previous_state.get('etag'):
+            headers['If-None-Match'] = previous_state['etag']
+        if previous_state.get('last_modified'):
+            headers['If-Modified-Since'] = previous_state['last_modified']
+    with SESSION.get(url, headers=headers, timeout=30, stream=True) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        # Hash the body as it arrives rather than decoding it to str first
+        hasher = hashlib.sha256()
+        chunks = []
+        for chunk in response.iter_content(chunk_size=16384):
+            hasher.update(chunk)
+            chunks.append(chunk)
+        return (b''.join(chunks), hasher.hexdigest(),
+                response.headers.get('ETag'), response.headers.get('Last-Modified'))
 
 
 def parse_match_text(match_text):
@@ -53,58 +97,116 @@ def parse_match_text(match_text):
     }
 
     # Extract date (e.g., "Nov 08, 2025")
-    date_match = re.search(r'([A-Z][a-z]{2}\s+\d{1,2},\s+\d{4})', match_text)
+    date_match = _DATE_RE.search(match_text)
     if date_match:
         match_info['date'] = date_match.group(1)
 
     # Extract time (e.g., "2:00 PM EST")
-    time_match = re.search(r'(\d{1,2}:\d{2}\s+[AP]M\s+[A-Z]{3})', match_text)
+    time_match = _TIME_RE.search(match_text)
     if time_match:
         match_info['time'] = time_match.group(1)
 
     # Extract score (e.g., "2 - 2")
-    score_match = re.search(r'(\d+\s*-\s*\d+)', match_text)
+    score_match = _SCORE_RE.search(match_text)
     if score_match:
         match_info['score'] = score_match.group(1)
 
     # Extract opponent (team name before date/time, excluding "Ambassadors FC")
     if '(H)' in match_text and '(A)' in match_text:
-        parts = match_text.split(match_info['date']) if match_info['date'] else [match_text]
-        if len(parts) >= 1:
-            home_part = parts[0]
-            if match_info['time']:
-                home_part = home_part.replace(match_info['time'], '')
-            if match_info['score']:
-                home_part = home_part.replace(match_info['score'], '')
-            home_team_match = re.search(r'([A-Z][^()]+?)\s*\([HA]\)', home_part)
-            if home_team_match:
-                home_team = home_team_match.group(1).strip()
-                if 'Ambassadors FC' not in home_team:
-                    match_info['opponent'] = home_team
-                    match_info['location'] = 'Away'
-                else:
-                    if len(parts) > 1:
-                        away_part = parts[1]
-                        away_team_match = re.search(r'([A-Z][^()]+?)\s*\([HA]\)', away_part)
-                        if away_team_match:
-                            match_info['opponent'] = away_team_match.group(1).strip()
-                            match_info['location'] = 'Home'
+        date_start = date_match.start() if date_match else len(match_text)
+        home_part = match_text[:date_start]
+        # Time and score only need stripping when their first occurrence is before the date
+        if time_match and time_match.end() <= date_start:
+            home_part = home_part.replace(match_info['time'], '')
+        if score_match and score_match.end() <= date_start:
+            home_part = home_part.replace(match_info['score'], '')
+        home_team_match = _TEAM_RE.search(home_part)
+        if home_team_match:
+            home_team = home_team_match.group(1).strip()
+            if 'Ambassadors FC' not in home_team:
+                match_info['opponent'] = home_team
+                match_info['location'] = 'Away'
+            elif date_match:
+                # Away side runs up to the next repeat of the date, if any
+                next_date = match_text.find(match_info['date'], date_match.end())
+                away_part = match_text[date_match.end():next_date if next_date != -1 else None]
+                away_team_match = _TEAM_RE.search(away_part)
+                if away_team_match:
+                    match_info['opponent'] = away_team_match.group(1).strip()
+                    match_info['location'] = 'Home'
 
     return match_info
 
 
+class MatchTextParser(HTMLParser):
+    """Streaming parser collecting the text of match containers without building a DOM.
+
+    Stdlib fallback for when selectolax isn't installed. Yields one text per div/tr whose
+    class contains a match keyword, in document order, built from its stripped text nodes
+    (nested containers included). Only the omitted </tr> end tag is inferred, so texts
+    can differ from the lexbor path on markup relying on other HTML5 recovery rules.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+        self._open = []  # (tag, index into texts, or None) for each open div/tr/table
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ('div', 'tr', 'table'):
+            return
+        if tag == 'tr':
+            # A new row implicitly ends an open row of the same table (omitted </tr>)
+            for pos in range(len(self._open) - 1, -1, -1):
+                if self._open[pos][0] == 'table':
+                    break
+                if self._open[pos][0] == 'tr':
+                    del self._open[pos:]
+                    break
+        index = None
+        if tag != 'table':
+            css_class = (dict(attrs).get('class') or '').lower()
+            if any(keyword in css_class for keyword in _MATCH_KEYWORDS):
+                index = len(self.texts)
+                self.texts.append([])
+        self._open.append((tag, index))
+
+    def handle_endtag(self, tag):
+        if tag not in ('div', 'tr', 'table'):
+            return
+        # Close the innermost element with this tag, and anything left unclosed inside it
+        for pos in range(len(self._open) - 1, -1, -1):
+            if self._open[pos][0] == tag:
+                del self._open[pos:]
+                break
+
+    def handle_data(self, data):
+        data = data.strip()
+        if data:
+            for _, index in self._open:
+                if index is not None:
+                    self.texts[index].append(data)
+
+
+def extract_match_texts(html_content):
+    """Return the text of every match container in the page"""
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html_content)
+        return [node.text(separator='', strip=True) for node in tree.css(_MATCH_SELECTOR)]
+
+    if isinstance(html_content, bytes):
+        html_content = html_content.decode('utf-8', errors='replace')
+    parser = MatchTextParser()
+    parser.feed(html_content)
+    parser.close()
+    return [''.join(parts) for parts in parser.texts]
+
+
 def parse_schedule(html_content):
     """Parse the schedule HTML and extract relevant information"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-
     schedule_data = {'matches': []}
 
-    matches = soup.find_all(['div', 'tr'], class_=lambda x: x and any(
-        keyword in str(x).lower() for keyword in ['game', 'match', 'schedule-row']
-    ))
-
-    for match in matches:
-        text = match.get_text(strip=True)
+    for text in extract_match_texts(html_content):
         if text and ('Ambassadors FC' in text or 'Nov' in text or 'Dec' in text):
             match_info = parse_match_text(text)
             schedule_data['matches'].append(match_info)
@@ -113,28 +215,69 @@ def parse_schedule(html_content):
 
 
 def calculate_hash(data):
-    """Calculate hash of the schedule data"""
-    json_str = json.dumps(data, sort_keys=True)
-    return hashlib.sha256(json_str.encode()).hexdigest()
+    """Calculate hash of the schedule data (change detection only, not security)"""
+    return hashlib.blake2b(orjson.dumps(data, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+def hash_file_for(state_file):
+    """Path of the small file holding the hashes and HTTP validators for a state file"""
+    return os.path.splitext(state_file)[0] + '.hash.json'
 
 
 def load_previous_state(state_file):
-    """Load the previous schedule state"""
-    if os.path.exists(state_file):
-        with open(state_file, 'r') as f:
+    """Load the previous schedule hashes and HTTP validators (without the schedule data)"""
+    # The data file is needed to diff against, so a state missing it counts as a first run
+    if not os.path.exists(state_file):
+        return None
+    hash_file = hash_file_for(state_file)
+    if os.path.exists(hash_file):
+        with open(hash_file, 'r') as f:
             return json.load(f)
-    return None
+    # Older runs stored everything in the state file itself; a new-format data file
+    # whose hash file is missing has no hash and also counts as a first run
+    with open(state_file, 'r') as f:
+        state = json.load(f)
+    return state if 'hash' in state else None
 
 
-def save_state(state_file, data, data_hash):
-    """Save the current schedule state"""
+def load_previous_data(state_file):
+    """Load the previous schedule data, or None if the data file is missing"""
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f)['data']
+
+
+def write_atomic(path, payload):
+    """Write bytes to path via a temp file and rename, so a crash never leaves a torn file"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def save_state_hash(state_file, data_hash, raw_hash=None, etag=None, last_modified=None):
+    """Save the current schedule hashes and HTTP validators"""
     state = {
         'hash': data_hash,
+        'hash_version': HASH_VERSION,
+        'raw_hash': raw_hash,
+        'etag': etag,
+        'last_modified': last_modified,
+        'timestamp': datetime.now().isoformat()
+    }
+    write_atomic(hash_file_for(state_file), orjson.dumps(state, option=orjson.OPT_INDENT_2))
+
+
+def save_state(state_file, data, data_hash, raw_hash=None, etag=None, last_modified=None):
+    """Save the current schedule state"""
+    state = {
         'data': data,
         'timestamp': datetime.now().isoformat()
     }
-    with open(state_file, 'w') as f:
-        json.dump(state, f, indent=2)
+    write_atomic(state_file, orjson.dumps(state, option=orjson.OPT_INDENT_2))
+    # Written last so it only ever describes data that is already on disk
+    save_state_hash(state_file, data_hash, raw_hash, etag, last_modified)
 
 
 def send_notification(title, message, priority="default", tags=None):
@@ -146,7 +289,7 @@ def send_notification(title, message, priority="default", tags=None):
         headers["Tags"] = ",".join(tags)
 
     full_message = f"{title}\n\n{message}"
-    response = requests.post(url, data=full_message.encode('utf-8'), headers=headers)
+    response = SESSION.post(url, data=full_message.encode('utf-8'), headers=headers)
     response.raise_for_status()
     print(f"Notification sent: {title}")
 
@@ -167,6 +310,11 @@ def format_match(match_info):
     return ' '.join(parts) if parts else match_info.get('raw', 'Unknown match')
 
 
+def _key_order(key):
+    """Sort key for (date, opponent) lookup keys; either part may be None"""
+    return tuple(part or '' for part in key)
+
+
 def detect_changes(old_data, new_data):
     """Detect what changed between old and new schedule data"""
     changes = []
@@ -179,30 +327,29 @@ def detect_changes(old_data, new_data):
             detailed_changes.append(f"  • {format_match(match)}")
         return changes, detailed_changes
 
-    old_matches = old_data.get('matches', [])
-    new_matches = new_data.get('matches', [])
-
-    old_lookup = {(m.get('date'), m.get('opponent')): m for m in old_matches}
-    new_lookup = {(m.get('date'), m.get('opponent')): m for m in new_matches}
+    old_lookup = {(m.get('date'), m.get('opponent')): m for m in old_data.get('matches', [])}
+    new_lookup = {(m.get('date'), m.get('opponent')): m for m in new_data.get('matches', [])}
 
-    old_keys = set(old_lookup.keys())
-    new_keys = set(new_lookup.keys())
-
-    added_keys = new_keys - old_keys
+    # Key views support set algebra directly, without building intermediate sets
+    added_keys = new_lookup.keys() - old_lookup.keys()
     if added_keys:
         changes.append(f"Added: {len(added_keys)} match(es)")
-        for key in sorted(added_keys):
+        for key in sorted(added_keys, key=_key_order):
             detailed_changes.append(f"✅ NEW MATCH: {format_match(new_lookup[key])}")
 
-    removed_keys = old_keys - new_keys
+    removed_keys = old_lookup.keys() - new_lookup.keys()
     if removed_keys:
         changes.append(f"Removed: {len(removed_keys)} match(es)")
-        for key in sorted(removed_keys):
+        for key in sorted(removed_keys, key=_key_order):
             detailed_changes.append(f"❌ REMOVED: {format_match(old_lookup[key])}")
 
-    for key in sorted(old_keys & new_keys):
+    # Compare common matches in any order; only the modified ones need sorting for output
+    modified = []
+    for key in old_lookup.keys() & new_lookup.keys():
         old_match = old_lookup[key]
         new_match = new_lookup[key]
+        if old_match == new_match:
+            continue
         match_changes = []
 
         if old_match.get('time') != new_match.get('time'):
@@ -213,10 +360,14 @@ def detect_changes(old_data, new_data):
             match_changes.append(f"Location: {old_match.get('location', 'TBD')} → {new_match.get('location', 'TBD')}")
 
         if match_changes:
-            changes.append(f"Modified: {format_match(new_match)}")
-            detailed_changes.append(f"🔄 UPDATED: {format_match(new_match)}")
-            for change in match_changes:
-                detailed_changes.append(f"    - {change}")
+            modified.append((key, match_changes))
+
+    for key, match_changes in sorted(modified, key=lambda item: _key_order(item[0])):
+        new_match = new_lookup[key]
+        changes.append(f"Modified: {format_match(new_match)}")
+        detailed_changes.append(f"🔄 UPDATED: {format_match(new_match)}")
+        for change in match_changes:
+            detailed_changes.append(f"    - {change}")
 
     if not changes:
         return ["No significant changes"], []
@@ -228,21 +379,39 @@ def check_schedule(label, url, state_file):
     """Check a single schedule URL for changes and notify if needed. Returns 0 on success, 1 on error."""
     print(f"\n--- Checking: {label} ---")
     try:
-        html_content = fetch_schedule(url)
+        previous_state = load_previous_state(state_file)
+
+        fetched = fetch_schedule(url, previous_state)
+        if fetched is None:
+            print("No changes detected (not modified)")
+            return 0
+        html_content, raw_hash, etag, last_modified = fetched
+
+        # Identical page bytes can't produce a different schedule, so skip parsing
+        if previous_state and previous_state.get('raw_hash') == raw_hash:
+            print("No changes detected (page unchanged)")
+            if (etag, last_modified) != (previous_state.get('etag'), previous_state.get('last_modified')):
+                save_state_hash(state_file, previous_state.get('hash'), raw_hash, etag, last_modified)
+            return 0
+
         schedule_data = parse_schedule(html_content)
         current_hash = calculate_hash(schedule_data)
-
-        previous_state = load_previous_state(state_file)
-        previous_hash = previous_state['hash'] if previous_state else None
+        previous_hash = previous_state.get('hash') if previous_state else None
 
         if current_hash != previous_hash:
-            print("Schedule has changed!")
-
             changes, detailed_changes = detect_changes(
-                previous_state['data'] if previous_state else None,
+                load_previous_data(state_file) if previous_state else None,
                 schedule_data
             )
 
+            # A hash from an older format always differs; only alert if the matches really changed
+            if previous_state and previous_state.get('hash_version', 1) != HASH_VERSION and not detailed_changes:
+                print("No changes detected (state hash format upgraded)")
+                save_state(state_file, schedule_data, current_hash, raw_hash, etag, last_modified)
+                return 0
+
+            print("Schedule has changed!")
+
             title = f"⚽ AFC Schedule Updated — {label}"
 
             if detailed_changes:
@@ -265,10 +434,12 @@ Last checked: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
                 tags=["soccer", "warning"]
             )
 
-            save_state(state_file, schedule_data, current_hash)
+            save_state(state_file, schedule_data, current_hash, raw_hash, etag, last_modified)
             print("State updated and notification sent")
         else:
             print("No changes detected")
+            # Page changed without affecting the parsed schedule; record the new raw hash and validators
+            save_state_hash(state_file, current_hash, raw_hash, etag, last_modified)
 
         return 0
 